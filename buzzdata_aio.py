@@ -0,0 +1,274 @@
+"""
+Asynchronous Buzzdata API client built on aiohttp.
+
+Mirrors the JSON endpoints of `buzzdata.Buzzdata` as coroutine methods,
+so fan-out workloads ("overview of every dataroom I own") can be
+gathered over one pooled keep-alive connection instead of blocking a
+thread per call. File transfer endpoints (datafile upload/download,
+image visualizations) are not mirrored; use the synchronous client for
+those.
+
+Requires aiohttp, which is an optional dependency of this package.
+"""
+
+import asyncio
+import gzip
+
+import aiohttp
+
+from buzzdata import (_dumps, _loads, _COMPRESS_THRESHOLD,
+                      _path_create_datafile, _path_datafile_history,
+                      _path_datarooms, _path_datarooms_list,
+                      _path_download_request, _path_list_datafiles,
+                      _path_stage, _path_stage_commit, _path_stage_row,
+                      _path_stage_rollback, _path_stage_rows,
+                      _path_upload_request, _path_visualization_url,
+                      _path_visualizations, _DOWNLOAD_TYPES, form)
+
+
+def _form_str(value):
+    # aiohttp form fields must be str; orjson serializes to bytes.
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _form_fields(data):
+    """
+    Normalize form data for aiohttp, which insists on str/bytes field
+    values: None-valued fields are dropped (requests does the same on
+    the sync side) and everything else is stringified, so defaults like
+    version=None or public=False encode the way the sync client sends
+    them instead of raising TypeError.
+    """
+    items = data.items() if isinstance(data, dict) else data
+    return [(key, value if isinstance(value, (str, bytes)) else str(value))
+            for key, value in items
+            if value is not None]
+
+
+class AsyncBuzzdata(object):
+    """
+    Buzzdata API Client (asyncio flavour). Use as an async context
+    manager, or call close() when done so the connection pool is
+    released.
+    """
+
+    class Error(Exception):
+        def __init__(self, code, body, text):
+            self.code = code
+            if body and 'message' in body:
+                self.message = body['message']
+            else:
+                self.message = text
+
+        def __str__(self):
+            return "Buzzdata API Error: %s (%r)" % (self.message, self.code)
+
+    def __init__(self, access_token=None, base_url="https://buzzdata.com",
+                 connection_limit=50):
+        self._url_prefix = base_url.rstrip('/') + '/api/'
+        if access_token is None:
+            self._params = {}
+        else:
+            self._params = {'access_token': access_token}
+        self._connection_limit = connection_limit
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # general info
+
+    def licenses(self):
+        return self._get("licenses")
+
+    def topics(self):
+        return self._get("topics")
+
+    def search(self, query):
+        return self._get("search", term=query)
+
+    # users
+
+    async def user_info(self, username):
+        return (await self._get(username))['user']
+
+    def create_user(self, username, email, password):
+        return self._post("users", data=form('user',
+                                             username=username,
+                                             email=email,
+                                             password=password))
+
+    # datarooms
+
+    def list_datarooms(self, username):
+        return self._get(_path_datarooms_list(username))
+
+    async def list_datarooms_with_details(self, username, concurrency=8):
+        """
+        List a user's datarooms and attach each room's visualizations
+        and datafiles under 'visualizations' and 'datafiles' keys. The
+        per-room follow-ups are gathered concurrently, bounded by a
+        semaphore so a user with hundreds of rooms doesn't stampede the
+        server.
+        """
+        gate = asyncio.Semaphore(concurrency)
+
+        async def details(room):
+            async with gate:
+                visualizations, datafiles = await asyncio.gather(
+                    self.list_visualizations(room['id']),
+                    self.list_datafiles(room['id']))
+            return dict(room,
+                        visualizations=visualizations,
+                        datafiles=datafiles)
+
+        rooms = await self.list_datarooms(username)
+        return list(await asyncio.gather(*map(details, rooms)))
+
+    async def create_dataroom(self, username, name, readme="", license="cc0",
+                              topics=[], public=False):
+        result = await self._post(_path_datarooms(username),
+                                  data=form('dataset',
+                                            name=name,
+                                            readme=readme,
+                                            license=license,
+                                            topics=topics,
+                                            public=public))
+        return result['dataset']
+
+    async def dataroom_overview(self, dataroom_id):
+        return (await self._get(dataroom_id))['dataset']
+
+    def delete_dataroom(self, dataroom_id):
+        return self._delete(dataroom_id)
+
+    # visualizations
+
+    async def list_visualizations(self, dataroom_id):
+        path = _path_visualizations(dataroom_id)
+        prefix = path + '/'
+        visualizations = await self._get(path)
+        for vis in visualizations:
+            vis['id'] = prefix + vis['uuid']
+        return visualizations
+
+    def create_visualization_from_url(self, dataroom_id, url, title=""):
+        return self._post(_path_visualization_url(dataroom_id),
+                          url=url,
+                          title=title)
+
+    def delete_visualization(self, visualization_id):
+        return self._delete(visualization_id)
+
+    # datafiles
+
+    def list_datafiles(self, dataroom_id):
+        return self._get(_path_list_datafiles(dataroom_id))
+
+    async def create_datafile(self, dataroom_id, datafile_name):
+        result = await self._post(_path_create_datafile(dataroom_id),
+                                  data_file_name=datafile_name)
+        return (dataroom_id, result['datafile_uuid'])
+
+    def datafile_history(self, datafile_id):
+        return self._get(_path_datafile_history(datafile_id[1]))
+
+    async def new_upload_request(self, datafile_id):
+        result = await self._post(_path_upload_request(*datafile_id))
+        return result['upload_request']
+
+    async def get_download_url(self, datafile_id, version=None, type='CSV'):
+        if type not in _DOWNLOAD_TYPES:
+            type = type.upper()
+            if type not in _DOWNLOAD_TYPES:
+                raise ValueError("Unknown file type '%s'" % type)
+        result = await self._post(_path_download_request(*datafile_id),
+                                  type=type,
+                                  version=version)
+        return result['download_request']['url']
+
+    # staging
+
+    async def create_stage(self, datafile_id):
+        result = await self._post(_path_stage(*datafile_id))
+        return datafile_id + (result['id'],)
+
+    def insert_rows(self, stage_id, rows):
+        return self._post_json(_path_stage_rows(*stage_id), rows)
+
+    def update_row(self, stage_id, row_number, row):
+        return self._put(_path_stage_row(*stage_id, row_number),
+                         row=_form_str(_dumps(row)))
+
+    def delete_row(self, stage_id, row_number):
+        return self._delete(_path_stage_row(*stage_id, row_number))
+
+    def commit_stage(self, stage_id):
+        return self._post(_path_stage_commit(*stage_id))
+
+    def rollback_stage(self, stage_id):
+        return self._post(_path_stage_rollback(*stage_id))
+
+    # private
+
+    def _ensure_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._connection_limit,
+                                             ttl_dns_cache=300,
+                                             keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def _request(self, method, path, params=None, data=None,
+                       headers=None):
+        session = self._ensure_session()
+        query = dict(self._params)
+        if params:
+            query.update(params)
+        async with session.request(method, self._url_prefix + path,
+                                   params=query, data=data,
+                                   headers=headers) as response:
+            content = await response.read()
+            if response.status >= 400:
+                try:
+                    body = _loads(content) if content else None
+                except Exception:
+                    body = None
+                raise AsyncBuzzdata.Error(response.status, body,
+                                          content.decode('utf-8', 'replace'))
+            return _loads(content) if content else None
+
+    def _get(self, path, **params):
+        return self._request('GET', path, params=params)
+
+    def _delete(self, path):
+        return self._request('DELETE', path)
+
+    def _put(self, path, **data):
+        return self._request('PUT', path, data=_form_fields(data))
+
+    def _post(self, path, data=None, **fields):
+        return self._request('POST', path,
+                             data=_form_fields(fields if data is None
+                                               else data))
+
+    def _post_json(self, path, payload):
+        # Same wire format as the sync client's _post_json: the
+        # serialized payload is the body itself, gzipped past the
+        # threshold, rather than a %-escaped form field.
+        body = _dumps(payload)
+        if isinstance(body, str):
+            body = body.encode()
+        headers = {'Content-Type': 'application/json'}
+        if len(body) >= _COMPRESS_THRESHOLD:
+            body = gzip.compress(body, compresslevel=1)
+            headers['Content-Encoding'] = 'gzip'
+        return self._request('POST', path, data=body, headers=headers)